@@ -8,19 +8,30 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "sqlite:///./face_attendance.db"
+    # Connection pool (ignored for SQLite)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_RECYCLE_SECONDS: int = 1800
     
     # Face Recognition
     FACE_RECOGNITION_TOLERANCE: float = 0.45  # Lower = stricter matching
     MIN_FACE_CONFIDENCE: float = 0.85
     FACE_ENCODINGS_PER_USER: int = 5
+    REGISTRATION_WORKERS: int = 5  # Processes encoding registration images (capped at CPU count)
+    FACE_DETECTION_SCALE: float = 0.5  # Detect on a downscaled frame; HOG misses faces under ~80 px
+    ENCODING_CACHE_TTL_SECONDS: float = 300.0  # Max age of each worker's cached encoding matrix
     
     # Anti-Spoofing
     BLINK_THRESHOLD: float = 0.25  # Eye aspect ratio threshold
     LIVENESS_FRAMES_REQUIRED: int = 3
-    TEXTURE_THRESHOLD: float = 0.6
+    TEXTURE_THRESHOLD: float = 0.55  # Mean per-cell uniform LBP entropy, 0-1
+    
+    # Users
+    USER_COUNT_CACHE_TTL_SECONDS: float = 30.0  # Total shown by /users/
     
     # Attendance
     MIN_HOURS_FOR_PUNCHOUT: int = 6
+    TODAY_CACHE_TTL_SECONDS: float = 5.0  # /attendance/today response cache
     
     # Storage
     UPLOAD_DIR: Path = Path("uploads")
@@ -1,14 +1,40 @@
 """Database connection and session management."""
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
 
+IS_SQLITE = settings.DATABASE_URL.startswith("sqlite")
+
 # Create database engine
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False}  # SQLite specific
-)
+if IS_SQLITE:
+    engine = create_engine(
+        settings.DATABASE_URL,
+        connect_args={"check_same_thread": False}
+    )
+else:
+    engine = create_engine(
+        settings.DATABASE_URL,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_pre_ping=True,  # Drop connections the server closed while idle
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS
+    )
+
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Tune every new SQLite connection for a single-writer web app."""
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers run alongside the writer and needs one fsync per
+        # commit with synchronous=NORMAL instead of two with a rollback journal
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-65536")    # 64 MiB page cache
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MiB memory map
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -30,3 +56,9 @@ def init_db():
     """Initialize database tables."""
     from models import User, FaceEncoding, AttendanceLog  # noqa: F401
     Base.metadata.create_all(bind=engine)
+    
+    # create_all skips tables that already exist, so also add any indexes
+    # that were introduced after an existing database was created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
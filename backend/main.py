@@ -3,8 +3,10 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from database import init_db
+from database import SessionLocal, engine, init_db
 from routes import users_router, attendance_router
+from routes.attendance import get_all_encodings, upgrade_legacy_encodings
+from services import face_service, create_registration_pool
 
 
 @asynccontextmanager
@@ -15,10 +17,30 @@ async def lifespan(app: FastAPI):
     init_db()
     print("✅ Database initialized")
     
-    yield
+    # Convert any float64 encodings left from before quantization, then pay
+    # for the encoding cache build and the first detector/encoder run here
+    # instead of on the first punch
+    with SessionLocal() as db:
+        upgraded = upgrade_legacy_encodings(db)
+        if upgraded:
+            print(f"✅ Converted {upgraded} legacy face encodings")
+        get_all_encodings(db)
+    face_service.warm_up()
+    print("✅ Encoding cache and face models warmed up")
     
-    # Shutdown
-    print("👋 Shutting down...")
+    # Worker processes for face registration; register_face replaces the
+    # pool if a worker dies, so shut down whichever one is current
+    app.state.process_pool = create_registration_pool()
+    
+    try:
+        yield
+    finally:
+        # Shutdown
+        print("👋 Shutting down...")
+        try:
+            app.state.process_pool.shutdown()
+        finally:
+            engine.dispose()
 
 
 # Create FastAPI app
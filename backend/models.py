@@ -1,6 +1,6 @@
 """SQLAlchemy database models."""
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, LargeBinary, Enum as SQLEnum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, LargeBinary, Index, Enum as SQLEnum
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 import enum
 
@@ -26,8 +26,9 @@ class User(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = Column(Integer, default=1)
     
-    # Profile photo (base64 encoded)
-    profile_photo = Column(LargeBinary, nullable=True)
+    # Profile photo (JPEG bytes); deferred so metadata queries skip the
+    # blob, routes that return it must undefer() it
+    profile_photo = deferred(Column(LargeBinary, nullable=True))
     
     # Relationships
     face_encodings = relationship("FaceEncoding", back_populates="user", cascade="all, delete-orphan")
@@ -42,9 +43,10 @@ class FaceEncoding(Base):
     __tablename__ = "face_encodings"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     
-    # 128D face encoding stored as binary (numpy array bytes)
+    # 128D face encoding stored as binary (int8 values + float32 scale, see
+    # FaceService.encoding_to_bytes; older rows hold raw float64 bytes)
     encoding = Column(LargeBinary, nullable=False)
     
     # Quality metrics
@@ -63,12 +65,16 @@ class FaceEncoding(Base):
 class AttendanceLog(Base):
     """Attendance log model for punch-in/out records."""
     __tablename__ = "attendance_logs"
+    __table_args__ = (
+        # Per-user day window lookups ordered by time (punch)
+        Index("ix_attendance_logs_user_id_timestamp", "user_id", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     punch_type = Column(SQLEnum(AttendanceType), nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)  # All-user day window (stats)
     
     # Verification data
     confidence_score = Column(Float, nullable=True)
@@ -1,10 +1,13 @@
 """Attendance management API routes."""
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased, contains_eager, raiseload
+from sqlalchemy import exists, func
 from datetime import datetime, date, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import asyncio
 import base64
+import time
+import numpy as np
 
 from database import get_db
 from models import User, FaceEncoding, AttendanceLog, AttendanceType
@@ -20,26 +23,165 @@ from config import settings
 router = APIRouter(prefix="/attendance", tags=["attendance"])
 
 
+# Decoded encodings of all active users. The cache is keyed on a fingerprint
+# of the active encodings read from the database, so changes committed by
+# other worker processes are seen on their next recognition; it is also
+# rebuilt after ENCODING_CACHE_TTL_SECONDS as a backstop. Routes that
+# add/remove encodings or deactivate users should still call
+# invalidate_encoding_cache() after committing, which forces a rebuild in
+# this process whatever the fingerprint says.
+_ENC_VERSION = 0
+_ENC_CACHE = {
+    "version": -1,
+    "fingerprint": None,   # (count, max id) of active encodings when built
+    "expires_at": 0.0,
+    "matrix": None,        # (N, 128) stacked encodings
+    "user_ids": None,      # (N,) owning user id per row
+    "names": None,         # (N,) owning user name per row
+    "employee_ids": None,  # (N,) owning employee id per row
+    "user_index": None,    # (N,) row -> index into centroids/radii
+    "centroids": None,     # (U, 128) mean encoding per user
+    "radii": None,         # (U,) farthest encoding from each centroid
+}
+
+
+def invalidate_encoding_cache():
+    """Mark the cached encoding matrix as stale."""
+    global _ENC_VERSION
+    _ENC_VERSION += 1
+
+
+# Short-lived copy of the /today response, which the dashboard polls.
+# Dropped whenever a punch is recorded so new logs show up immediately.
+_TODAY_CACHE = {"date": None, "expires_at": 0.0, "response": None}
+
+
+def invalidate_today_cache():
+    """Drop the cached /today response."""
+    _TODAY_CACHE["response"] = None
+
+
+def upgrade_legacy_encodings(db: Session) -> int:
+    """
+    Rewrite encodings still stored as raw float64 in the current int8 format.
+    
+    Stored formats are told apart by blob length, so this is safe to run on
+    every startup; it returns the number of rows converted.
+    """
+    legacy = (
+        db.query(FaceEncoding)
+        .options(raiseload("*"))
+        .filter(func.length(FaceEncoding.encoding) == face_service.LEGACY_ENCODING_BYTES)
+        .all()
+    )
+    
+    if not legacy:
+        return 0
+    
+    matrix = face_service.bytes_to_encodings([enc.encoding for enc in legacy])
+    for enc, encoding in zip(legacy, matrix):
+        enc.encoding = face_service.encoding_to_bytes(encoding)
+    
+    db.commit()
+    invalidate_encoding_cache()
+    
+    return len(legacy)
+
+
+def _encoding_fingerprint(db: Session) -> Tuple[int, Optional[int]]:
+    """
+    Get (count, max id) of the encodings of active users.
+    
+    Deactivating a user or deleting encodings lowers the count, and new
+    encodings always raise the max id, so any change made through the API
+    changes the fingerprint.
+    """
+    count, max_id = (
+        db.query(func.count(FaceEncoding.id), func.max(FaceEncoding.id))
+        .join(FaceEncoding.user)
+        .filter(User.is_active == 1)
+        .one()
+    )
+    return count, max_id
+
+
 def get_all_encodings(db: Session):
-    """Get all face encodings from database."""
-    all_encodings = db.query(FaceEncoding).join(User).filter(User.is_active == 1).all()
+    """Get all active face encodings as a cached, stacked matrix."""
+    now = time.monotonic()
+    fingerprint = _encoding_fingerprint(db)
+    if (
+        _ENC_CACHE["version"] == _ENC_VERSION
+        and _ENC_CACHE["fingerprint"] == fingerprint
+        and now < _ENC_CACHE["expires_at"]
+    ):
+        return _ENC_CACHE
+    
+    version = _ENC_VERSION
+    
+    # Populate enc.user from the join itself so reading name/employee_id
+    # below does not fire a lazy SELECT per encoding
+    all_encodings = (
+        db.query(FaceEncoding)
+        .join(FaceEncoding.user)
+        .options(contains_eager(FaceEncoding.user), raiseload("*"))
+        .filter(User.is_active == 1)
+        .all()
+    )
     
-    encodings_data = []
-    for enc in all_encodings:
-        encodings_data.append({
-            "user_id": enc.user_id,
-            "user_name": enc.user.name,
-            "employee_id": enc.user.employee_id,
-            "encoding": face_service.bytes_to_encoding(enc.encoding)
-        })
+    matrix = face_service.bytes_to_encodings([enc.encoding for enc in all_encodings])
+    user_ids = np.array([enc.user_id for enc in all_encodings], dtype=np.int64)
+    
+    # Per-user centroid and radius, used to prune users before the full pass
+    _, user_index, counts = np.unique(user_ids, return_inverse=True, return_counts=True)
+    centroids = np.zeros((len(counts), matrix.shape[1]), dtype=np.float32)
+    np.add.at(centroids, user_index, matrix)
+    centroids /= counts[:, None]
+    radii = np.zeros(len(counts), dtype=np.float32)
+    np.maximum.at(radii, user_index, np.linalg.norm(matrix - centroids[user_index], axis=1))
+    
+    _ENC_CACHE.update(
+        version=version,
+        fingerprint=fingerprint,
+        expires_at=now + settings.ENCODING_CACHE_TTL_SECONDS,
+        matrix=matrix,
+        user_ids=user_ids,
+        names=[enc.user.name for enc in all_encodings],
+        employee_ids=[enc.user.employee_id for enc in all_encodings],
+        user_index=user_index,
+        centroids=centroids,
+        radii=radii,
+    )
+    
+    return _ENC_CACHE
+
+
+def _day_range(day: date) -> Tuple[datetime, Optional[datetime]]:
+    """
+    Get the half-open [start, end) datetime range covering a day.
     
-    return encodings_data
+    end is None for date.max, whose next midnight is not representable;
+    the range then has no upper bound.
+    """
+    start = datetime(day.year, day.month, day.day)
+    if day == date.max:
+        return start, None
+    return start, start + timedelta(days=1)
+
+
+async def decode_and_detect_frames(frames_b64: list):
+    """Decode several frames concurrently, then detect faces in them as a batch."""
+    frames = await asyncio.gather(*[
+        asyncio.to_thread(face_service.decode_base64_image, f) for f in frames_b64
+    ])
+    locations = await asyncio.to_thread(face_service.detect_faces_batch, frames)
+    return list(zip(frames, locations))
 
 
 def recognize_face(image_b64: str, db: Session):
     """Recognize a face from an image."""
-    # Decode image
-    image = face_service.decode_base64_image(image_b64)
+    # Decode image, keeping the raw bytes for storage as photo evidence
+    image_bytes = face_service.decode_base64(image_b64)
+    image = face_service.decode_image_bytes(image_bytes)
     
     # Detect faces
     face_locations = face_service.detect_faces(image)
@@ -59,44 +201,39 @@ def recognize_face(image_b64: str, db: Session):
         return None, "Could not extract face features"
     
     # Get all stored encodings
-    all_encodings_data = get_all_encodings(db)
+    cache = get_all_encodings(db)
     
-    if not all_encodings_data:
+    if len(cache["user_ids"]) == 0:
         return None, "No registered users in the system"
     
-    # Group encodings by user
-    user_encodings = {}
-    for enc_data in all_encodings_data:
-        user_id = enc_data["user_id"]
-        if user_id not in user_encodings:
-            user_encodings[user_id] = {
-                "encodings": [],
-                "name": enc_data["user_name"],
-                "employee_id": enc_data["employee_id"]
-            }
-        user_encodings[user_id]["encodings"].append(enc_data["encoding"])
-    
-    # Find best match across all users
-    best_match = None
-    best_confidence = 0.0
-    
-    for user_id, data in user_encodings.items():
-        is_match, confidence, _ = face_service.compare_faces(
-            data["encodings"],
-            encoding
-        )
-        
-        if is_match and confidence > best_confidence:
-            best_confidence = confidence
-            best_match = {
-                "user_id": user_id,
-                "user_name": data["name"],
-                "employee_id": data["employee_id"],
-                "confidence": confidence,
-                "face_location": list(face_location)
-            }
-    
-    if best_match:
+    # Skip users that cannot match: no encoding of a user is closer than its
+    # centroid distance minus the user's radius (triangle inequality)
+    tolerance = settings.FACE_RECOGNITION_TOLERANCE
+    centroid_distances = np.linalg.norm(cache["centroids"] - encoding, axis=1)
+    candidates = centroid_distances - cache["radii"] <= tolerance
+    rows = np.flatnonzero(candidates[cache["user_index"]])
+    
+    if len(rows) == 0:
+        return None, "Face not recognized - not a registered user"
+    
+    # One distance pass over the remaining encodings; the closest row across
+    # all users is also the best per-user match
+    is_match, confidence, best = face_service.compare_faces(
+        cache["matrix"][rows], encoding, tolerance
+    )
+    best_row = rows[best]
+    
+    if is_match:
+        best_match = {
+            "user_id": int(cache["user_ids"][best_row]),
+            "user_name": cache["names"][best_row],
+            "employee_id": cache["employee_ids"][best_row],
+            "confidence": float(confidence),
+            "face_location": list(face_location),
+            # Decoded probe, so callers can reuse it instead of decoding again
+            "image": image,
+            "image_bytes": image_bytes
+        }
         return best_match, "Face recognized successfully"
     
     return None, "Face not recognized - not a registered user"
@@ -149,15 +286,25 @@ async def punch(request: PunchRequest, db: Session = Depends(get_db)):
     # Liveness check if multiple frames provided
     liveness_passed = True
     if request.frames and len(request.frames) >= 2:
-        frames = [face_service.decode_base64_image(f) for f in request.frames[:5]]
-        face_locations = [face_service.detect_faces(f) for f in frames]
+        # Filter frames with detected faces. The punch image is usually one
+        # of the frames, and recognition already decoded and detected it.
+        frames_b64 = request.frames[:5]
+        is_probe = [f == request.image for f in frames_b64]
+        decoded = iter(await decode_and_detect_frames(
+            [f for f, probe in zip(frames_b64, is_probe) if not probe]
+        ))
         
-        # Filter frames with detected faces
         valid_frames = []
         valid_locations = []
-        for f, locs in zip(frames, face_locations):
+        for probe in is_probe:
+            if probe:
+                valid_frames.append(match["image"])
+                valid_locations.append(tuple(match["face_location"]))
+                continue
+            
+            frame, locs = next(decoded)
             if locs:
-                valid_frames.append(f)
+                valid_frames.append(frame)
                 valid_locations.append(locs[0])
         
         if len(valid_frames) >= 2:
@@ -176,14 +323,12 @@ async def punch(request: PunchRequest, db: Session = Depends(get_db)):
                 )
     
     # Check today's attendance
-    today = date.today()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
+    today_start, tomorrow_start = _day_range(date.today())
     
     today_logs = db.query(AttendanceLog).filter(
         AttendanceLog.user_id == user_id,
         AttendanceLog.timestamp >= today_start,
-        AttendanceLog.timestamp <= today_end
+        AttendanceLog.timestamp < tomorrow_start
     ).order_by(AttendanceLog.timestamp.desc()).all()
     
     # Determine punch type
@@ -221,25 +366,17 @@ async def punch(request: PunchRequest, db: Session = Depends(get_db)):
                 )
     
     # Create attendance log
-    photo_bytes = None
-    try:
-        if "," in request.image:
-            photo_bytes = base64.b64decode(request.image.split(",")[1])
-        else:
-            photo_bytes = base64.b64decode(request.image)
-    except:
-        pass
-    
     attendance = AttendanceLog(
         user_id=user_id,
         punch_type=punch_type,
         confidence_score=confidence,
         liveness_passed=1 if liveness_passed else 0,
-        photo_evidence=photo_bytes
+        photo_evidence=match["image_bytes"]
     )
     db.add(attendance)
     db.commit()
     db.refresh(attendance)
+    invalidate_today_cache()
     
     return PunchResponse(
         success=True,
@@ -253,6 +390,26 @@ async def punch(request: PunchRequest, db: Session = Depends(get_db)):
     )
 
 
+def _log_to_response(log: AttendanceLog) -> AttendanceLogResponse:
+    """Build the API representation of an attendance log."""
+    photo_evidence = None
+    if log.photo_evidence:
+        photo_evidence = base64.b64encode(log.photo_evidence).decode()
+    
+    # Fields come straight from the ORM row, so skip re-validating them
+    return AttendanceLogResponse.model_construct(
+        id=log.id,
+        user_id=log.user_id,
+        user_name=log.user.name,
+        employee_id=log.user.employee_id,
+        punch_type=log.punch_type.value,
+        timestamp=log.timestamp,
+        confidence=log.confidence_score,
+        liveness_passed=bool(log.liveness_passed),
+        photo_evidence=photo_evidence
+    )
+
+
 @router.get("/history", response_model=AttendanceHistoryResponse)
 async def get_attendance_history(
     user_id: Optional[int] = None,
@@ -269,73 +426,96 @@ async def get_attendance_history(
         query = query.filter(AttendanceLog.user_id == user_id)
     
     if start_date:
-        query = query.filter(AttendanceLog.timestamp >= datetime.combine(start_date, datetime.min.time()))
+        query = query.filter(AttendanceLog.timestamp >= _day_range(start_date)[0])
     
     if end_date:
-        query = query.filter(AttendanceLog.timestamp <= datetime.combine(end_date, datetime.max.time()))
+        end = _day_range(end_date)[1]
+        if end is not None:
+            query = query.filter(AttendanceLog.timestamp < end)
     
     total = query.count()
-    logs = query.order_by(AttendanceLog.timestamp.desc()).offset(skip).limit(limit).all()
-    
-    log_responses = []
-    for log in logs:
-        photo_evidence = None
-        if log.photo_evidence:
-            photo_evidence = base64.b64encode(log.photo_evidence).decode()
-        
-        log_responses.append(AttendanceLogResponse(
-            id=log.id,
-            user_id=log.user_id,
-            user_name=log.user.name,
-            employee_id=log.user.employee_id,
-            punch_type=log.punch_type.value,
-            timestamp=log.timestamp,
-            confidence=log.confidence_score,
-            liveness_passed=bool(log.liveness_passed),
-            photo_evidence=photo_evidence
-        ))
+    logs = (
+        query.options(contains_eager(AttendanceLog.user), raiseload("*"))
+        .order_by(AttendanceLog.timestamp.desc())
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
     
-    return AttendanceHistoryResponse(logs=log_responses, total=total)
+    return AttendanceHistoryResponse.model_construct(logs=[_log_to_response(log) for log in logs], total=total)
 
 
 @router.get("/today", response_model=AttendanceHistoryResponse)
 async def get_today_attendance(db: Session = Depends(get_db)):
     """Get today's attendance logs."""
     today = date.today()
-    return await get_attendance_history(start_date=today, end_date=today, db=db)
+    now = time.monotonic()
+    
+    cached = _TODAY_CACHE["response"]
+    if cached is not None and _TODAY_CACHE["date"] == today and now < _TODAY_CACHE["expires_at"]:
+        return cached
+    
+    today_start, tomorrow_start = _day_range(today)
+    
+    query = db.query(AttendanceLog).join(User).filter(
+        AttendanceLog.timestamp >= today_start,
+        AttendanceLog.timestamp < tomorrow_start
+    )
+    
+    total = query.count()
+    logs = (
+        query.options(contains_eager(AttendanceLog.user), raiseload("*"))
+        .order_by(AttendanceLog.timestamp.desc())
+        .limit(50)
+        .all()
+    )
+    
+    response = AttendanceHistoryResponse.model_construct(logs=[_log_to_response(log) for log in logs], total=total)
+    _TODAY_CACHE.update(
+        date=today,
+        expires_at=now + settings.TODAY_CACHE_TTL_SECONDS,
+        response=response,
+    )
+    
+    return response
 
 
 @router.get("/stats/today", response_model=TodayStatsResponse)
 async def get_today_stats(db: Session = Depends(get_db)):
     """Get today's attendance statistics."""
-    today = date.today()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
+    today_start, tomorrow_start = _day_range(date.today())
     
     # Total active employees
-    total_employees = db.query(User).filter(User.is_active == 1).count()
+    total_employees = db.query(func.count(User.id)).filter(User.is_active == 1).scalar()
     
-    # Get today's logs
-    today_logs = db.query(AttendanceLog).filter(
-        AttendanceLog.timestamp >= today_start,
-        AttendanceLog.timestamp <= today_end
-    ).all()
+    def in_window(log):
+        return (log.timestamp >= today_start, log.timestamp < tomorrow_start)
     
-    # Count unique users who punched in
-    punched_in_users = set()
-    punched_out_users = set()
+    # Count unique users per punch type without loading the logs
+    users_by_type = dict(
+        db.query(AttendanceLog.punch_type, func.count(func.distinct(AttendanceLog.user_id)))
+        .filter(*in_window(AttendanceLog))
+        .group_by(AttendanceLog.punch_type)
+        .all()
+    )
     
-    for log in today_logs:
-        if log.punch_type == AttendanceType.PUNCH_IN:
-            punched_in_users.add(log.user_id)
-        elif log.punch_type == AttendanceType.PUNCH_OUT:
-            punched_out_users.add(log.user_id)
+    # Users who punched in today and have not punched out yet
+    punch_out = aliased(AttendanceLog)
+    still_punched_in = db.query(func.count(func.distinct(AttendanceLog.user_id))).filter(
+        *in_window(AttendanceLog),
+        AttendanceLog.punch_type == AttendanceType.PUNCH_IN,
+        ~exists().where(
+            punch_out.user_id == AttendanceLog.user_id,
+            punch_out.punch_type == AttendanceType.PUNCH_OUT,
+            *in_window(punch_out)
+        )
+    ).scalar()
     
     return TodayStatsResponse(
         total_employees=total_employees,
-        present_today=len(punched_in_users),
-        punched_in=len(punched_in_users - punched_out_users),
-        punched_out=len(punched_out_users)
+        present_today=users_by_type.get(AttendanceType.PUNCH_IN, 0),
+        punched_in=still_punched_in,
+        punched_out=users_by_type.get(AttendanceType.PUNCH_OUT, 0)
     )
 
 
@@ -356,15 +536,11 @@ async def check_liveness(request: LivenessCheckRequest):
             message="At least 2 frames required for liveness check"
         )
     
-    # Decode frames
-    frames = [face_service.decode_base64_image(f) for f in request.frames[:5]]
-    
-    # Get face locations
+    # Decode frames and get face locations
     face_locations = []
     valid_frames = []
     
-    for frame in frames:
-        locs = face_service.detect_faces(frame)
+    for frame, locs in await decode_and_detect_frames(request.frames[:5]):
         if locs:
             face_locations.append(locs[0])
             valid_frames.append(frame)
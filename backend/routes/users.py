@@ -1,8 +1,12 @@
 """User management API routes."""
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session, raiseload, undefer
+from sqlalchemy import func
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+import asyncio
 import base64
+import time
 
 from database import get_db
 from models import User, FaceEncoding
@@ -10,12 +14,34 @@ from schemas import (
     UserCreate, UserResponse, UserListResponse,
     FaceRegistrationRequest, FaceRegistrationResponse
 )
-from services import face_service
+from services import face_service, create_registration_pool
+from .attendance import invalidate_encoding_cache
 from config import settings
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
+# Active-user total for list responses, so paging does not COUNT(*) the
+# table on every request. Dropped when users are created or deactivated.
+_USER_COUNT_CACHE = {"expires_at": 0.0, "total": None}
+
+
+def _active_user_count(db: Session) -> int:
+    """Get the number of active users, cached for a short TTL."""
+    now = time.monotonic()
+    if _USER_COUNT_CACHE["total"] is None or now >= _USER_COUNT_CACHE["expires_at"]:
+        _USER_COUNT_CACHE.update(
+            total=db.query(func.count(User.id)).filter(User.is_active == 1).scalar(),
+            expires_at=now + settings.USER_COUNT_CACHE_TTL_SECONDS,
+        )
+    return _USER_COUNT_CACHE["total"]
+
+
+def _invalidate_user_count():
+    """Drop the cached active-user total."""
+    _USER_COUNT_CACHE["total"] = None
+
+
 @router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
     """Create a new user."""
@@ -47,6 +73,7 @@ async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
     db.add(user)
     db.commit()
     db.refresh(user)
+    _invalidate_user_count()
     
     return UserResponse(
         id=user.id,
@@ -64,20 +91,46 @@ async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
 async def list_users(
     skip: int = 0,
     limit: int = 50,
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """List all users."""
-    total = db.query(User).filter(User.is_active == 1).count()
-    users = db.query(User).filter(User.is_active == 1).offset(skip).limit(limit).all()
+    """
+    List all users.
+    
+    Pass the previous page's next_after_id as after_id to page by key
+    instead of by offset.
+    """
+    query = (
+        db.query(User)
+        .options(undefer(User.profile_photo), raiseload("*"))
+        .filter(User.is_active == 1)
+        .order_by(User.id)
+    )
+    
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    else:
+        query = query.offset(skip)
+    
+    users = query.limit(limit).all()
+    
+    # Count encodings for the whole page in one query instead of loading
+    # each user's encoding blobs
+    encoding_counts = dict(
+        db.query(FaceEncoding.user_id, func.count(FaceEncoding.id))
+        .filter(FaceEncoding.user_id.in_([user.id for user in users]))
+        .group_by(FaceEncoding.user_id)
+        .all()
+    )
     
     user_responses = []
     for user in users:
-        has_face = len(user.face_encodings) > 0
+        has_face = encoding_counts.get(user.id, 0) > 0
         profile_photo = None
         if user.profile_photo:
             profile_photo = base64.b64encode(user.profile_photo).decode()
         
-        user_responses.append(UserResponse(
+        user_responses.append(UserResponse.model_construct(
             id=user.id,
             employee_id=user.employee_id,
             name=user.name,
@@ -89,20 +142,32 @@ async def list_users(
             profile_photo=profile_photo
         ))
     
-    return UserListResponse(users=user_responses, total=total)
+    # Built from ORM rows, so skip re-validating every user
+    return UserListResponse.model_construct(
+        users=user_responses,
+        total=_active_user_count(db),
+        next_after_id=users[-1].id if users and len(users) == limit else None
+    )
 
 
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user(user_id: int, db: Session = Depends(get_db)):
     """Get a specific user by ID."""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = (
+        db.query(User)
+        .options(undefer(User.profile_photo), raiseload("*"))
+        .filter(User.id == user_id)
+        .first()
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User with ID {user_id} not found"
         )
     
-    has_face = len(user.face_encodings) > 0
+    has_face = db.query(
+        db.query(FaceEncoding.id).filter(FaceEncoding.user_id == user.id).exists()
+    ).scalar()
     profile_photo = None
     if user.profile_photo:
         profile_photo = base64.b64encode(user.profile_photo).decode()
@@ -132,10 +197,16 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
     
     user.is_active = 0
     db.commit()
+    _invalidate_user_count()
+    invalidate_encoding_cache()
 
 
 @router.post("/register-face", response_model=FaceRegistrationResponse)
-async def register_face(request: FaceRegistrationRequest, db: Session = Depends(get_db)):
+async def register_face(
+    request: FaceRegistrationRequest,
+    http_request: Request,
+    db: Session = Depends(get_db)
+):
     """
     Register face images for a user.
     
@@ -155,59 +226,59 @@ async def register_face(request: FaceRegistrationRequest, db: Session = Depends(
     # Default angle labels
     angle_labels = request.angle_labels or ["front"] * len(request.images)
     
-    for i, image_b64 in enumerate(request.images):
+    # Decode, detect and encode all images in parallel on the worker pool.
+    # Without one (app started without its lifespan) they run here one at a
+    # time: the face models must not be used from several threads at once.
+    pool = getattr(http_request.app.state, "process_pool", None)
+    if pool is None:
+        results = [face_service.process_registration_image(image_b64) for image_b64 in request.images]
+    else:
+        loop = asyncio.get_running_loop()
         try:
-            # Decode image
-            image = face_service.decode_base64_image(image_b64)
-            
-            # Detect faces
-            face_locations = face_service.detect_faces(image)
-            
-            if len(face_locations) == 0:
-                quality_issues.append(f"Image {i+1}: No face detected")
-                continue
-            
-            if len(face_locations) > 1:
-                quality_issues.append(f"Image {i+1}: Multiple faces detected, using largest")
-            
-            # Use the largest face
-            face_location = max(face_locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
-            
-            # Validate face quality
-            is_valid, message = face_service.validate_face_quality(image, face_location)
-            if not is_valid:
-                quality_issues.append(f"Image {i+1}: {message}")
-                continue
-            
-            # Generate encoding
-            encoding = face_service.get_face_encoding(image, face_location)
-            if encoding is None:
-                quality_issues.append(f"Image {i+1}: Could not generate face encoding")
-                continue
-            
-            # Store encoding
-            face_encoding = FaceEncoding(
-                user_id=user.id,
-                encoding=face_service.encoding_to_bytes(encoding),
-                confidence=0.95,  # Placeholder, would use actual detection confidence
-                angle_label=angle_labels[i] if i < len(angle_labels) else "front"
+            results = await asyncio.gather(*[
+                loop.run_in_executor(pool, face_service.process_registration_image, image_b64)
+                for image_b64 in request.images
+            ])
+        except BrokenProcessPool:
+            # A worker died (crashed in dlib, OOM-killed, ...) and the pool
+            # refuses all further work; replace it so later requests succeed.
+            # Starting processes blocks, so build the new pool off the loop,
+            # and keep only one if several requests hit the broken pool.
+            state = http_request.app.state
+            if state.process_pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                replacement = await asyncio.to_thread(create_registration_pool)
+                if state.process_pool is pool:
+                    state.process_pool = replacement
+                else:
+                    replacement.shutdown(wait=False)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Face processing was interrupted, please try again"
             )
-            db.add(face_encoding)
-            encodings_saved += 1
-            
-            # Set first good image as profile photo
-            if user.profile_photo is None:
-                top, right, bottom, left = face_location
-                face_crop = image[top:bottom, left:right]
-                user.profile_photo = base64.b64decode(
-                    face_service.encode_image_to_base64(face_crop)
-                )
-        
-        except Exception as e:
-            quality_issues.append(f"Image {i+1}: Error - {str(e)}")
+    
+    for i, (encoding_bytes, face_photo, issues) in enumerate(results):
+        quality_issues.extend(f"Image {i+1}: {issue}" for issue in issues)
+        if encoding_bytes is None:
             continue
+        
+        # Store encoding
+        face_encoding = FaceEncoding(
+            user_id=user.id,
+            encoding=encoding_bytes,
+            confidence=0.95,  # Placeholder, would use actual detection confidence
+            angle_label=angle_labels[i] if i < len(angle_labels) else "front"
+        )
+        db.add(face_encoding)
+        encodings_saved += 1
+        
+        # Set first good image as profile photo
+        if user.profile_photo is None:
+            user.profile_photo = face_photo
     
     db.commit()
+    if encodings_saved:
+        invalidate_encoding_cache()
     
     success = encodings_saved > 0
     message = f"Successfully registered {encodings_saved} face encoding(s)" if success else "No faces could be registered"
@@ -230,16 +301,21 @@ async def get_face_encodings_count(user_id: int, db: Session = Depends(get_db)):
             detail=f"User with ID {user_id} not found"
         )
     
+    # Only the metadata columns; the encoding blobs are not needed here
+    encodings = db.query(
+        FaceEncoding.id, FaceEncoding.angle_label, FaceEncoding.created_at
+    ).filter(FaceEncoding.user_id == user_id).all()
+    
     return {
         "user_id": user_id,
-        "encoding_count": len(user.face_encodings),
+        "encoding_count": len(encodings),
         "encodings": [
             {
                 "id": enc.id,
                 "angle": enc.angle_label,
                 "created_at": enc.created_at
             }
-            for enc in user.face_encodings
+            for enc in encodings
         ]
     }
 
@@ -257,3 +333,4 @@ async def delete_face_encodings(user_id: int, db: Session = Depends(get_db)):
     db.query(FaceEncoding).filter(FaceEncoding.user_id == user_id).delete()
     user.profile_photo = None
     db.commit()
+    invalidate_encoding_cache()
@@ -1,9 +1,14 @@
 """Pydantic schemas for API request/response validation."""
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field, Strict
+from typing import Annotated, Optional, List
 from datetime import datetime
 
 
+# Base64 image payloads can run to megabytes: accept JSON strings as they are,
+# with no coercion, and keep them out of model reprs (and so out of logs)
+Base64Image = Annotated[str, Strict()]
+
+
 # ============ User Schemas ============
 
 class UserCreate(BaseModel):
@@ -26,14 +31,14 @@ class UserResponse(BaseModel):
     has_face_registered: bool = False
     profile_photo: Optional[str] = None  # Base64 encoded
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserListResponse(BaseModel):
     """Schema for list of users."""
     users: List[UserResponse]
     total: int
+    next_after_id: Optional[int] = None  # Pass as after_id to fetch the next page
 
 
 # ============ Face Registration Schemas ============
@@ -41,7 +46,7 @@ class UserListResponse(BaseModel):
 class FaceRegistrationRequest(BaseModel):
     """Schema for registering face images."""
     user_id: int
-    images: List[str]  # List of base64 encoded images
+    images: List[Base64Image] = Field(..., repr=False)  # List of base64 encoded images
     angle_labels: Optional[List[str]] = None  # front, left, right, up, down
 
 
@@ -57,8 +62,8 @@ class FaceRegistrationResponse(BaseModel):
 
 class PunchRequest(BaseModel):
     """Schema for punch in/out request."""
-    image: str  # Base64 encoded image
-    frames: Optional[List[str]] = None  # Multiple frames for liveness check
+    image: Base64Image = Field(..., repr=False)  # Base64 encoded image
+    frames: Optional[List[Base64Image]] = Field(None, repr=False)  # Multiple frames for liveness check
 
 
 class PunchResponse(BaseModel):
@@ -85,8 +90,7 @@ class AttendanceLogResponse(BaseModel):
     liveness_passed: bool
     photo_evidence: Optional[str] = None  # Base64 encoded
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class AttendanceHistoryResponse(BaseModel):
@@ -107,7 +111,7 @@ class TodayStatsResponse(BaseModel):
 
 class RecognitionRequest(BaseModel):
     """Schema for face recognition request."""
-    image: str  # Base64 encoded image
+    image: Base64Image = Field(..., repr=False)  # Base64 encoded image
 
 
 class RecognitionResponse(BaseModel):
@@ -125,7 +129,7 @@ class RecognitionResponse(BaseModel):
 
 class LivenessCheckRequest(BaseModel):
     """Schema for liveness check request."""
-    frames: List[str]  # List of base64 encoded frames
+    frames: List[Base64Image] = Field(..., repr=False)  # List of base64 encoded frames
 
 
 class LivenessCheckResponse(BaseModel):
@@ -1,13 +1,71 @@
 """Anti-spoofing service for liveness detection."""
 import numpy as np
 import cv2
+import scipy.ndimage as ndi
 from typing import List, Tuple, Optional
-from scipy.spatial import distance as spatial_distance
-from collections import deque
 
 from config import settings
 
 
+def _uniform_lbp_lut(points: int) -> np.ndarray:
+    """
+    Map every LBP code to its uniform-pattern bin.
+    
+    Codes with at most two circular 0/1 transitions map to their number of
+    set bits (0..points); every other code shares bin points + 1.
+    """
+    bits = (np.arange(1 << points)[:, None] >> np.arange(points)) & 1
+    transitions = np.count_nonzero(bits != np.roll(bits, 1, axis=1), axis=1)
+    lut = np.where(transitions <= 2, bits.sum(axis=1), points + 1).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+class _RingBuffer:
+    """
+    Fixed-capacity history kept in a preallocated numpy array.
+    
+    Every item is written twice, capacity slots apart, so the items from
+    oldest to newest are always one contiguous slice and view() never copies.
+    """
+    
+    def __init__(self, capacity: int, dtype=np.float64):
+        self.capacity = capacity
+        self.dtype = dtype
+        self._data = None  # (2 * capacity, *item_shape), allocated on first append
+        self._start = 0
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def append(self, item):
+        """Add an item, dropping the oldest one once full."""
+        item = np.asarray(item, dtype=self.dtype)
+        if self._data is None:
+            self._data = np.empty((2 * self.capacity,) + item.shape, dtype=self.dtype)
+        
+        end = (self._start + self._size) % self.capacity
+        self._data[end] = item
+        self._data[end + self.capacity] = item
+        
+        if self._size < self.capacity:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+    
+    def view(self) -> np.ndarray:
+        """Items from oldest to newest, as a view into the buffer."""
+        if self._data is None:
+            return np.empty(0, dtype=self.dtype)
+        return self._data[self._start:self._start + self._size]
+    
+    def clear(self):
+        """Drop all items, keeping the allocated buffer."""
+        self._start = 0
+        self._size = 0
+
+
 class AntiSpoofService:
     """Service for detecting face spoofing attempts."""
     
@@ -15,9 +73,42 @@ class AntiSpoofService:
     LEFT_EYE_INDICES = list(range(36, 42))
     RIGHT_EYE_INDICES = list(range(42, 48))
     
+    # LBP over the 3x3 neighborhood: (dy, dx) of each neighbor in circular
+    # order, bit p set when neighbor p >= center. Codes are folded into
+    # P + 2 uniform bins (P + 1 uniform codes plus one bin for all
+    # non-uniform patterns)
+    LBP_NEIGHBORS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+    LBP_POINTS = len(LBP_NEIGHBORS)
+    LBP_BINS = LBP_POINTS + 2
+    _LBP_UNIFORM_LUT = _uniform_lbp_lut(LBP_POINTS)
+    
+    # Texture is scored over a LBP_SIZE x LBP_SIZE face crop split into
+    # square cells of LBP_CELL pixels, one histogram per cell
+    LBP_SIZE = 128
+    LBP_CELL = 16
+    LBP_CELLS = LBP_SIZE // LBP_CELL  # Cells per side
+    
+    # Invariants of the per-cell histogram, computed once: each cell's first
+    # bin in the flat bincount, laid out to broadcast over the
+    # (cell_y, y, cell_x, x) view of the LBP map; c * log2(c) for every
+    # count a bin can hold, so entropy is read off the raw counts; and the
+    # largest possible entropy
+    _LBP_BIN_OFFSETS = (
+        (np.arange(LBP_CELLS)[:, None] * LBP_CELLS + np.arange(LBP_CELLS)) * LBP_BINS
+    ).astype(np.intp)[:, None, :, None]
+    _LBP_BIN_OFFSETS.flags.writeable = False
+    _LBP_COUNT_XLOGX = np.arange(LBP_CELL ** 2 + 1, dtype=np.float64)
+    _LBP_COUNT_XLOGX[1:] *= np.log2(_LBP_COUNT_XLOGX[1:])
+    _LBP_COUNT_XLOGX.flags.writeable = False
+    _LBP_MAX_ENTROPY = float(np.log2(LBP_BINS))
+    
+    # EAR point pairs: the two vertical pairs, then the horizontal one
+    EAR_PAIRS_FROM = [1, 2, 0]
+    EAR_PAIRS_TO = [5, 4, 3]
+    
     def __init__(self):
-        self.blink_history = deque(maxlen=30)  # Track last 30 frames
-        self.motion_history = deque(maxlen=10)
+        self.blink_history = _RingBuffer(30)  # Track last 30 frames
+        self.motion_history = _RingBuffer(10)
         
     def calculate_eye_aspect_ratio(self, eye_points: np.ndarray) -> float:
         """
@@ -28,18 +119,23 @@ class AntiSpoofService:
         When eye is open: EAR ~ 0.25-0.35
         When eye is closed: EAR ~ 0.1-0.2
         """
-        # Vertical distances
-        v1 = spatial_distance.euclidean(eye_points[1], eye_points[5])
-        v2 = spatial_distance.euclidean(eye_points[2], eye_points[4])
-        
-        # Horizontal distance
-        h = spatial_distance.euclidean(eye_points[0], eye_points[3])
-        
-        if h == 0:
-            return 0.0
-            
-        ear = (v1 + v2) / (2.0 * h)
-        return ear
+        return float(self._eye_aspect_ratios(np.asarray(eye_points)[np.newaxis])[0])
+    
+    def _eye_aspect_ratios(self, eyes: np.ndarray) -> np.ndarray:
+        """Calculate the EAR of a stack of eyes shaped (n_eyes, 6, 2) in one pass."""
+        distances = np.linalg.norm(
+            eyes[:, self.EAR_PAIRS_FROM] - eyes[:, self.EAR_PAIRS_TO],
+            axis=2
+        )
+        horizontal = 2.0 * distances[:, 2]
+        
+        # EAR is 0 for degenerate eyes with no horizontal extent
+        return np.divide(
+            distances[:, 0] + distances[:, 1],
+            horizontal,
+            out=np.zeros_like(horizontal),
+            where=horizontal != 0
+        )
     
     def detect_blink(self, left_eye: np.ndarray, right_eye: np.ndarray) -> Tuple[bool, float]:
         """
@@ -47,10 +143,9 @@ class AntiSpoofService:
         
         Returns: (is_blinking, average_ear)
         """
-        left_ear = self.calculate_eye_aspect_ratio(left_eye)
-        right_ear = self.calculate_eye_aspect_ratio(right_eye)
+        left_ear, right_ear = self._eye_aspect_ratios(np.stack([left_eye, right_eye]))
         
-        avg_ear = (left_ear + right_ear) / 2.0
+        avg_ear = float(left_ear + right_ear) / 2.0
         is_blinking = avg_ear < settings.BLINK_THRESHOLD
         
         self.blink_history.append(avg_ear)
@@ -66,21 +161,14 @@ class AntiSpoofService:
         if len(self.blink_history) < 10:
             return False, "Collecting frames..."
         
-        history = list(self.blink_history)
+        history = self.blink_history.view()
         
-        # Look for blink pattern
-        blink_detected = False
-        for i in range(len(history) - 5):
-            window = history[i:i+6]
-            
-            # Check for open-close-open pattern
-            max_ear = max(window)
-            min_ear = min(window)
-            
-            if max_ear > 0.25 and min_ear < 0.2:
-                # Found transition
-                blink_detected = True
-                break
+        # Look for an open-close-open transition within any 6-frame window.
+        # Edge windows are shorter, but each is contained in a full window,
+        # so they cannot add matches.
+        max_ear = ndi.maximum_filter1d(history, size=6, mode="nearest")
+        min_ear = ndi.minimum_filter1d(history, size=6, mode="nearest")
+        blink_detected = bool(((max_ear > 0.25) & (min_ear < 0.2)).any())
         
         if blink_detected:
             return True, "Blink detected - liveness confirmed"
@@ -93,53 +181,54 @@ class AntiSpoofService:
         
         Real faces have more texture variation than printed photos.
         """
-        # Convert to grayscale
-        if len(face_image.shape) == 3:
-            gray = cv2.cvtColor(face_image, cv2.COLOR_RGB2GRAY)
-        else:
-            gray = face_image
-        
-        # Resize for consistent analysis
-        face_resized = cv2.resize(gray, (128, 128))
-        
-        # Calculate LBP
-        lbp = self._compute_lbp(face_resized)
-        
-        # Calculate histogram
-        hist, _ = np.histogram(lbp.ravel(), bins=256, range=(0, 256))
-        hist = hist.astype(float)
-        hist /= (hist.sum() + 1e-7)
-        
-        # Calculate texture score (entropy-based)
-        entropy = -np.sum(hist * np.log2(hist + 1e-7))
-        
-        # Normalize to 0-1 range (typical entropy range is 4-8)
-        texture_score = min(1.0, entropy / 8.0)
+        # Resize for consistent analysis (with a 1-pixel border, so the LBP
+        # map is LBP_SIZE square), then convert only the small copy to
+        # grayscale
+        face_resized = cv2.resize(face_image, (self.LBP_SIZE + 2, self.LBP_SIZE + 2))
+        if face_resized.ndim == 3:
+            face_resized = cv2.cvtColor(face_resized, cv2.COLOR_RGB2GRAY)
+        
+        # Calculate uniform LBP
+        lbp = cv2.LUT(self._compute_lbp(face_resized), self._LBP_UNIFORM_LUT)
+        
+        # Per-cell histograms in a single bincount: view the map as
+        # (cell_y, y, cell_x, x) and offset each code by its cell's bin range
+        codes = lbp.reshape(self.LBP_CELLS, self.LBP_CELL, self.LBP_CELLS, self.LBP_CELL) + self._LBP_BIN_OFFSETS
+        counts = np.bincount(
+            codes.ravel(),
+            minlength=self.LBP_CELLS * self.LBP_CELLS * self.LBP_BINS,
+        )
+        
+        # Calculate texture score (mean entropy over the cells). With n pixels
+        # per cell, -sum(p * log2(p)) over p = c / n equals
+        # log2(n) - sum(c * log2(c)) / n, so the counts are never normalized
+        pixels = self.LBP_CELL ** 2
+        entropy = np.log2(pixels) - self._LBP_COUNT_XLOGX[counts].sum() / (pixels * self.LBP_CELLS ** 2)
+        
+        # Normalize to 0-1 range (maximum entropy over the bins is log2(bins))
+        texture_score = min(1.0, entropy / self._LBP_MAX_ENTROPY)
         
         # Real faces typically have higher texture scores
         is_real = texture_score > settings.TEXTURE_THRESHOLD
         
         return is_real, texture_score
     
-    def _compute_lbp(self, image: np.ndarray, radius: int = 1, points: int = 8) -> np.ndarray:
-        """Compute Local Binary Pattern of image."""
+    def _compute_lbp(self, image: np.ndarray) -> np.ndarray:
+        """LBP codes of every interior pixel of a grayscale image."""
         rows, cols = image.shape
-        output = np.zeros((rows - 2*radius, cols - 2*radius), dtype=np.uint8)
-        
-        for i in range(radius, rows - radius):
-            for j in range(radius, cols - radius):
-                center = image[i, j]
-                binary = 0
-                
-                for p in range(points):
-                    angle = 2 * np.pi * p / points
-                    x = int(round(i + radius * np.sin(angle)))
-                    y = int(round(j + radius * np.cos(angle)))
-                    
-                    if image[x, y] >= center:
-                        binary |= (1 << p)
-                
-                output[i - radius, j - radius] = binary
+        
+        # Compare every pixel against each neighbor at once using shifted
+        # views, reusing one scratch buffer instead of allocating per bit
+        center = image[1:rows - 1, 1:cols - 1]
+        output = np.zeros(center.shape, dtype=np.uint8)
+        mask = np.empty(center.shape, dtype=bool)
+        bits = mask.view(np.uint8)
+        
+        for p, (dy, dx) in enumerate(self.LBP_NEIGHBORS):
+            neighbor = image[1 + dy:rows - 1 + dy, 1 + dx:cols - 1 + dx]
+            np.greater_equal(neighbor, center, out=mask)
+            np.left_shift(bits, p, out=bits)
+            output |= bits
         
         return output
     
@@ -205,14 +294,11 @@ class AntiSpoofService:
         
         # Motion analysis across frames
         if landmarks_list and len(landmarks_list) >= 2:
-            for i in range(1, len(landmarks_list)):
-                has_motion, _ = self.detect_motion(
-                    landmarks_list[i],
-                    landmarks_list[i-1]
-                )
-                if has_motion:
-                    results["motion_passed"] = True
-                    break
+            # Mean absolute landmark shift between each consecutive pair,
+            # same thresholds as detect_motion
+            landmarks = np.stack(landmarks_list).astype(np.float64)
+            movements = np.abs(np.diff(landmarks, axis=0)).reshape(len(landmarks) - 1, -1).mean(axis=1)
+            results["motion_passed"] = bool(((movements > 0.3) & (movements < 20.0)).any())
         
         # Calculate overall confidence
         confidence = 0.0
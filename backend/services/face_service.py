@@ -1,52 +1,146 @@
 """Face detection and recognition service."""
 import numpy as np
 import face_recognition
+import dlib
 import cv2
 import base64
-from typing import Optional, Tuple, List
-from io import BytesIO
-from PIL import Image
+import binascii
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, List, Union
 
 from config import settings
 
 
+# Decoder behind base64.b64decode, called directly to skip its str -> bytes
+# conversion; it already ignores non-alphabet characters like b64decode's
+# default validate=False
+_a2b_base64 = binascii.a2b_base64
+
+# A dlib detector must not be used from two threads at once (each call loads
+# the image into the detector's scanner), and face_recognition shares one
+# module-level detector. Every thread that detects faces gets its own.
+_thread_state = threading.local()
+
+
+def _face_detector():
+    """Get this thread's HOG face detector, creating it on first use."""
+    detector = getattr(_thread_state, "face_detector", None)
+    if detector is None:
+        detector = _thread_state.face_detector = dlib.get_frontal_face_detector()
+    return detector
+
+
+# Long-lived threads for detect_faces_batch. dlib's HOG detector releases the
+# GIL while it runs, and each thread uses its own detector (above), so frames
+# can be detected in parallel on separate cores. With a single core the pool
+# only adds hand-off cost and is not used.
+_DETECTION_WORKERS = os.cpu_count() or 1
+_DETECTION_POOL = ThreadPoolExecutor(max_workers=_DETECTION_WORKERS, thread_name_prefix="face-detect")
+
+
 class FaceService:
     """Service for face detection, encoding, and recognition."""
     
+    ENCODING_DIM = 128
+    # Stored layout written by encoding_to_bytes
+    ENCODING_RECORD = np.dtype([("values", np.int8, (ENCODING_DIM,)), ("scale", np.float32)])
+    # Size of encodings stored as raw float64 before int8 quantization
+    LEGACY_ENCODING_BYTES = ENCODING_DIM * 8
+    
     @staticmethod
-    def decode_base64_image(base64_string: str) -> np.ndarray:
-        """Decode base64 image to numpy array."""
-        # Remove data URL prefix if present
-        if "," in base64_string:
-            base64_string = base64_string.split(",")[1]
+    def decode_base64(base64_string: Union[str, bytes]) -> bytes:
+        """Decode a base64 string or bytes (optionally a data URL) to raw bytes."""
+        # Remove data URL prefix if present; bytes are sliced as a view
+        if isinstance(base64_string, str):
+            comma = base64_string.find(",")
+            if comma != -1:
+                base64_string = base64_string[comma + 1:]
+        else:
+            comma = base64_string.find(b",")
+            if comma != -1:
+                base64_string = memoryview(base64_string)[comma + 1:]
         
-        image_bytes = base64.b64decode(base64_string)
-        image = Image.open(BytesIO(image_bytes))
+        return _a2b_base64(base64_string)
+    
+    @staticmethod
+    def decode_base64_image(base64_string: Union[str, bytes]) -> np.ndarray:
+        """Decode base64 image to an RGB numpy array (OpenCV's BGR output is converted)."""
+        return FaceService.decode_image_bytes(FaceService.decode_base64(base64_string))
+    
+    @staticmethod
+    def decode_image_bytes(image_bytes: bytes) -> np.ndarray:
+        """Decode encoded image bytes (JPEG, PNG, ...) to an RGB numpy array."""
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
         
-        # Convert to RGB if necessary
-        if image.mode != "RGB":
-            image = image.convert("RGB")
+        if image is None:
+            raise ValueError("Could not decode image")
         
-        return np.array(image)
+        # OpenCV decodes to BGR
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    
+    @staticmethod
+    def encode_image_to_bytes(image: np.ndarray) -> bytes:
+        """Encode RGB numpy array image to JPEG bytes."""
+        ok, buffer = cv2.imencode(
+            ".jpg",
+            cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+            [cv2.IMWRITE_JPEG_QUALITY, 85]
+        )
+        
+        if not ok:
+            raise ValueError("Could not encode image")
+        
+        return buffer.tobytes()
     
     @staticmethod
     def encode_image_to_base64(image: np.ndarray) -> str:
-        """Encode numpy array image to base64."""
-        pil_image = Image.fromarray(image)
-        buffer = BytesIO()
-        pil_image.save(buffer, format="JPEG", quality=85)
-        return base64.b64encode(buffer.getvalue()).decode()
+        """Encode RGB numpy array image to base64 JPEG (converted to BGR for OpenCV)."""
+        return base64.b64encode(FaceService.encode_image_to_bytes(image)).decode()
     
     @staticmethod
-    def detect_faces(image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    def detect_faces(image: np.ndarray, scale: float = None) -> List[Tuple[int, int, int, int]]:
         """
         Detect faces in an image.
         
+        Args:
+            image: RGB image as numpy array
+            scale: Factor to shrink the image by before detection; boxes are
+                mapped back to full-resolution coordinates
+        
         Returns: List of face locations as (top, right, bottom, left) tuples
         """
-        # Use HOG model for speed, use "cnn" for better accuracy (GPU required)
-        face_locations = face_recognition.face_locations(image, model="hog")
-        return face_locations
+        if scale is None:
+            scale = settings.FACE_DETECTION_SCALE
+        
+        # HOG cost grows with the pixel count, so detect on a smaller copy
+        if scale < 1.0:
+            small = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            small, scale = image, 1.0
+        
+        # HOG model with one upsample, as face_recognition.face_locations does,
+        # but on this thread's own detector
+        rects = _face_detector()(small, 1)
+        
+        height, width = image.shape[:2]
+        return [
+            (
+                max(0, round(rect.top() / scale)),
+                min(width, round(rect.right() / scale)),
+                min(height, round(rect.bottom() / scale)),
+                max(0, round(rect.left() / scale))
+            )
+            for rect in rects
+        ]
+    
+    @staticmethod
+    def detect_faces_batch(frames: List[np.ndarray]) -> List[List[Tuple[int, int, int, int]]]:
+        """Detect faces in several frames, in parallel when there are cores to spare."""
+        if _DETECTION_WORKERS == 1 or len(frames) < 2:
+            return [FaceService.detect_faces(frame) for frame in frames]
+        return list(_DETECTION_POOL.map(FaceService.detect_faces, frames))
     
     @staticmethod
     def get_face_encoding(image: np.ndarray, face_location: Optional[Tuple] = None) -> Optional[np.ndarray]:
@@ -57,7 +151,7 @@ class FaceService:
             image: RGB image as numpy array
             face_location: Optional (top, right, bottom, left) tuple
             
-        Returns: 128D face encoding or None if no face found
+        Returns: 128D float32 face encoding or None if no face found
         """
         known_face_locations = [face_location] if face_location else None
         
@@ -68,28 +162,33 @@ class FaceService:
         )
         
         if encodings:
-            return encodings[0]
+            return encodings[0].astype(np.float32)
         return None
     
     @staticmethod
     def compare_faces(
-        known_encodings: List[np.ndarray],
+        known_matrix: np.ndarray,
         face_to_check: np.ndarray,
         tolerance: float = None
     ) -> Tuple[bool, float, int]:
         """
         Compare a face encoding against known encodings.
         
+        Args:
+            known_matrix: (N, 128) float32 matrix of known encodings
+            face_to_check: 128D encoding to look up
+            tolerance: Maximum distance for a match
+            
         Returns: (is_match, best_confidence, best_match_index)
         """
         if tolerance is None:
             tolerance = settings.FACE_RECOGNITION_TOLERANCE
         
-        if not known_encodings:
+        if len(known_matrix) == 0:
             return False, 0.0, -1
         
-        # Calculate face distances
-        distances = face_recognition.face_distance(known_encodings, face_to_check)
+        # Calculate face distances (Euclidean, as face_recognition.face_distance)
+        distances = np.linalg.norm(known_matrix - np.asarray(face_to_check, dtype=np.float32), axis=1)
         
         # Find best match
         best_index = np.argmin(distances)
@@ -105,13 +204,90 @@ class FaceService:
     
     @staticmethod
     def encoding_to_bytes(encoding: np.ndarray) -> bytes:
-        """Convert numpy encoding to bytes for database storage."""
-        return encoding.tobytes()
+        """
+        Convert numpy encoding to bytes for database storage.
+        
+        The encoding is quantized to int8 against its largest magnitude and
+        stored followed by that scale as float32 (132 bytes instead of 1024).
+        """
+        scale = float(np.max(np.abs(encoding))) or 1.0
+        quantized = np.round(encoding * (127.0 / scale)).astype(np.int8)
+        return quantized.tobytes() + np.float32(scale).tobytes()
     
     @staticmethod
     def bytes_to_encoding(data: bytes) -> np.ndarray:
-        """Convert bytes back to numpy encoding."""
-        return np.frombuffer(data, dtype=np.float64)
+        """Convert bytes back to a float32 numpy encoding."""
+        return FaceService.bytes_to_encodings([data])[0]
+    
+    @staticmethod
+    def bytes_to_encodings(blobs: List[bytes]) -> np.ndarray:
+        """
+        Convert many stored encodings into one contiguous (N, 128) float32 matrix.
+        
+        Blobs are joined once and viewed in place with np.frombuffer, so no
+        per-row arrays are allocated.
+        """
+        matrix = np.empty((len(blobs), FaceService.ENCODING_DIM), dtype=np.float32)
+        is_legacy = np.array([len(b) == FaceService.LEGACY_ENCODING_BYTES for b in blobs], dtype=bool)
+        
+        if is_legacy.any():
+            legacy = b"".join(b for b, old in zip(blobs, is_legacy) if old)
+            matrix[is_legacy] = np.frombuffer(legacy, dtype=np.float64).reshape(-1, FaceService.ENCODING_DIM)
+        
+        if not is_legacy.all():
+            current = b"".join(b for b, old in zip(blobs, is_legacy) if not old)
+            records = np.frombuffer(current, dtype=FaceService.ENCODING_RECORD)
+            matrix[~is_legacy] = records["values"] * (records["scale"] / np.float32(127.0))[:, None]
+        
+        return matrix
+    
+    @staticmethod
+    def process_registration_image(image_b64: str) -> Tuple[Optional[bytes], Optional[bytes], List[str]]:
+        """
+        Decode, detect, validate and encode one registration image.
+        
+        Only takes and returns picklable values so it can run in a worker
+        process.
+        
+        Returns: (encoding_bytes, face_crop_jpeg, issues) where encoding_bytes
+        is None if the image was rejected
+        """
+        issues = []
+        try:
+            image = FaceService.decode_base64_image(image_b64)
+            
+            face_locations = FaceService.detect_faces(image)
+            if len(face_locations) == 0:
+                return None, None, ["No face detected"]
+            
+            if len(face_locations) > 1:
+                issues.append("Multiple faces detected, using largest")
+            
+            # Use the largest face
+            face_location = max(face_locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
+            
+            is_valid, message = FaceService.validate_face_quality(image, face_location)
+            if not is_valid:
+                return None, None, issues + [message]
+            
+            encoding = FaceService.get_face_encoding(image, face_location)
+            if encoding is None:
+                return None, None, issues + ["Could not generate face encoding"]
+            
+            top, right, bottom, left = face_location
+            face_crop = image[top:bottom, left:right]
+            
+            return FaceService.encoding_to_bytes(encoding), FaceService.encode_image_to_bytes(face_crop), issues
+        
+        except Exception as e:
+            return None, None, issues + [f"Error - {str(e)}"]
+    
+    @staticmethod
+    def warm_up():
+        """Run detection and encoding once so the first request skips their setup cost."""
+        dummy = np.zeros((64, 64, 3), dtype=np.uint8)
+        FaceService.detect_faces(dummy)
+        FaceService.get_face_encoding(dummy, (0, 63, 63, 0))
     
     @staticmethod
     def validate_face_quality(
@@ -148,9 +324,10 @@ class FaceService:
         if abs(face_center_y - img_height // 2) > img_height * center_tolerance:
             return False, "Please center your face vertically."
         
-        # Check brightness
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        brightness = np.mean(gray)
+        # Check brightness; weight the channel means the way RGB2GRAY weights
+        # the channels instead of converting every pixel
+        red, green, blue = cv2.mean(image)[:3]
+        brightness = 0.299 * red + 0.587 * green + 0.114 * blue
         
         if brightness < 60:
             return False, "Image is too dark. Please improve lighting."
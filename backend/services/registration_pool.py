@@ -0,0 +1,29 @@
+"""Worker process pool for face registration."""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+from config import settings
+from .face_service import face_service
+
+
+def create_registration_pool() -> ProcessPoolExecutor:
+    """
+    Start the worker processes that run process_registration_image.
+    
+    Spawned rather than forked, since forking a process that already runs
+    threads is unsafe. Each worker warms its own face models when it starts.
+    """
+    workers = min(settings.REGISTRATION_WORKERS, os.cpu_count() or 1)
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=face_service.warm_up
+    )
+    
+    # Workers are spawned on demand; queue one no-op each so they all start
+    # (and warm up) now rather than on the first registration
+    for _ in range(workers):
+        pool.submit(os.getpid)
+    
+    return pool
@@ -0,0 +1,93 @@
+"""Shared fixtures for backend tests."""
+import os
+import tempfile
+
+# Point the app at a throwaway SQLite database before config is imported
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from database import SessionLocal, engine, init_db
+from main import app
+from models import User, FaceEncoding, AttendanceLog, AttendanceType
+from routes.attendance import invalidate_encoding_cache, invalidate_today_cache
+from routes.users import _invalidate_user_count
+from services import face_service
+
+
+@pytest.fixture(scope="session")
+def seed():
+    """
+    Create the schema and a small data set shared by all tests.
+    
+    Three active users: one with two encodings, a photo and logs today and
+    yesterday, one with one encoding and a log today, and one with neither.
+    """
+    init_db()
+    rng = np.random.default_rng(0)
+    
+    with SessionLocal() as db:
+        users = [
+            User(employee_id=f"E{i}", name=f"User {i}", email=f"user{i}@example.com")
+            for i in range(3)
+        ]
+        users[0].profile_photo = b"\xff\xd8 photo"
+        db.add_all(users)
+        db.flush()
+        
+        for user, n_encodings in zip(users, (2, 1, 0)):
+            for _ in range(n_encodings):
+                db.add(FaceEncoding(
+                    user_id=user.id,
+                    encoding=face_service.encoding_to_bytes(rng.normal(0, 0.1, 128).astype(np.float32)),
+                    angle_label="front"
+                ))
+        
+        today_noon = datetime.combine(date.today(), time(12))
+        for user, timestamp in (
+            (users[0], today_noon - timedelta(days=1)),
+            (users[0], today_noon),
+            (users[1], today_noon),
+        ):
+            db.add(AttendanceLog(
+                user_id=user.id,
+                punch_type=AttendanceType.PUNCH_IN,
+                timestamp=timestamp,
+                confidence_score=0.9,
+                photo_evidence=b"\xff\xd8 evidence"
+            ))
+        
+        db.commit()
+        return [user.id for user in users]
+
+
+@pytest.fixture
+def client(seed):
+    """Test client; the lifespan (model warm-up, worker pool) is not run."""
+    return TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start each test with the in-process response and data caches empty."""
+    invalidate_encoding_cache()
+    invalidate_today_cache()
+    _invalidate_user_count()
+
+
+@pytest.fixture
+def queries():
+    """Record the SQL statements executed while the test runs."""
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", record)
@@ -0,0 +1,40 @@
+"""
+Texture check decisions around TEXTURE_THRESHOLD.
+
+The threshold is calibrated against the current texture score, so a change
+to the scoring that moves these inputs across it should retune the
+threshold along with it.
+"""
+import cv2
+import numpy as np
+import pytest
+
+from services import anti_spoof_service
+
+rng = np.random.default_rng(0)
+TEXTURED = cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), (0, 0), 1.5)
+
+
+@pytest.mark.parametrize("frame", [
+    TEXTURED,
+    # Gray input, and a face-crop sized region
+    cv2.cvtColor(TEXTURED, cv2.COLOR_RGB2GRAY),
+    TEXTURED[100:300, 200:380],
+])
+def test_textured_frame_passes(frame):
+    is_real, score = anti_spoof_service.analyze_texture(frame)
+    
+    assert is_real
+    assert 0.0 <= score <= 1.0
+
+
+@pytest.mark.parametrize("frame", [
+    np.full((480, 640, 3), 128, dtype=np.uint8),
+    np.tile(np.linspace(0, 255, 640, dtype=np.uint8), (480, 1)),
+    cv2.GaussianBlur(TEXTURED, (0, 0), 20),
+])
+def test_featureless_frame_fails(frame):
+    is_real, score = anti_spoof_service.analyze_texture(frame)
+    
+    assert not is_real
+    assert 0.0 <= score <= 1.0
@@ -0,0 +1,9 @@
+"""Tests for the attendance routes."""
+
+
+def test_attendance_history_end_date_max(client, seed):
+    # The day after date.max does not exist; the range is left open instead
+    response = client.get("/attendance/history", params={"end_date": "9999-12-31"})
+    
+    assert response.status_code == 200
+    assert response.json()["total"] == 3
@@ -0,0 +1,79 @@
+"""
+Query-count tests for the list and detail endpoints.
+
+These queries load relationships with raiseload("*"), so a lazy load added
+later raises instead of silently issuing one SELECT per row. These tests
+turn that into a failure here rather than a 500 in production, and pin the
+number of statements each endpoint runs.
+"""
+from database import SessionLocal
+from routes.attendance import get_all_encodings
+
+
+def test_list_users(client, seed, queries):
+    response = client.get("/users/")
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total"] == 3
+    assert [user["has_face_registered"] for user in body["users"]] == [True, True, False]
+    assert body["users"][0]["profile_photo"]
+    # Page, encoding counts for the page, active-user total
+    assert len(queries) == 3
+
+
+def test_list_users_keyset_page(client, seed, queries):
+    response = client.get("/users/", params={"after_id": seed[0], "limit": 1})
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert [user["id"] for user in body["users"]] == [seed[1]]
+    assert body["next_after_id"] == seed[1]
+    assert len(queries) == 3
+
+
+def test_get_user(client, seed, queries):
+    response = client.get(f"/users/{seed[0]}")
+    
+    assert response.status_code == 200
+    assert response.json()["has_face_registered"] is True
+    # User row, has-encoding EXISTS
+    assert len(queries) == 2
+
+
+def test_attendance_history(client, seed, queries):
+    response = client.get("/attendance/history", params={"start_date": "2000-01-01"})
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total"] == 3
+    assert all(log["user_name"] and log["photo_evidence"] for log in body["logs"])
+    # Total, page joined with users
+    assert len(queries) == 2
+
+
+def test_today_attendance(client, seed, queries):
+    response = client.get("/attendance/today")
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total"] == 2
+    assert {log["user_name"] for log in body["logs"]} == {"User 0", "User 1"}
+    assert len(queries) == 2
+    
+    # Served from the short-lived response cache
+    assert client.get("/attendance/today").json() == body
+    assert len(queries) == 2
+
+
+def test_encoding_cache(seed, queries):
+    with SessionLocal() as db:
+        cache = get_all_encodings(db)
+        assert list(cache["user_ids"]) == [seed[0], seed[0], seed[1]]
+        assert cache["names"] == ["User 0", "User 0", "User 1"]
+        # Fingerprint, encodings joined with users
+        assert len(queries) == 2
+        
+        # Unchanged data: only the fingerprint is read
+        assert get_all_encodings(db) is cache
+        assert len(queries) == 3